@@ -5,22 +5,53 @@ Backend Container App that receives and validates JWT tokens from Microsoft Entr
 import os
 import sys
 import json
+import base64
+import binascii
+import hashlib
 import logging
-from datetime import datetime
-from flask import Flask, request, jsonify
+import random
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, Response, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import jwt
 from jwt import PyJWKClient
 from functools import wraps
 
-# Configure logging
+# Configure logging (set LOG_LEVEL=DEBUG to log full token claims)
+LOG_LEVEL = (os.environ.get('LOG_LEVEL') or 'INFO').upper()
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOG_LEVEL if LOG_LEVEL in logging.getLevelNamesMapping() else logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
+    stream=sys.stdout,
+    force=True
 )
 logger = logging.getLogger(__name__)
+if LOG_LEVEL not in logging.getLevelNamesMapping():
+    logger.warning("Unknown LOG_LEVEL %r, falling back to INFO", LOG_LEVEL)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson, falling back to the stdlib json module"""
+
+    # Match orjson's insertion-ordered output when falling back
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            # orjson rejects values such as integers beyond 64 bits
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configuration from environment variables
 TENANT_ID = os.environ.get('AZURE_TENANT_ID', '')
@@ -28,9 +59,168 @@ CLIENT_ID = os.environ.get('AZURE_CLIENT_ID', '')
 # Support both v1.0 and v2.0 token issuers
 ISSUER_V1 = f'https://sts.windows.net/{TENANT_ID}/'
 ISSUER_V2 = f'https://login.microsoftonline.com/{TENANT_ID}/v2.0'
+# PyJWT only treats a list (not a tuple) as a set of accepted issuers
+ISSUERS = [ISSUER_V1, ISSUER_V2]
+ALGORITHMS = ('RS256',)
 JWKS_URI = f'https://login.microsoftonline.com/{TENANT_ID}/discovery/v2.0/keys'
 # Accept both Client ID and api:// URI as audience
 AUDIENCE = f'api://{CLIENT_ID}'
+# Entra ID tokens are a few KB; anything far larger is rejected before decoding
+MAX_AUTH_HEADER_LENGTH = 16384
+# Response bodies are plain dicts: a Flask Response can't be built before an app context
+INVALID_ISSUER_ERROR = {'error': 'Invalid token issuer'}
+# Health check body is serialized once; only the timestamp is appended per request
+HEALTH_STATUS = {
+    'status': 'healthy',
+    'service': 'jwt-backend',
+    'tenant_id': TENANT_ID,
+    'client_id': CLIENT_ID
+}
+HEALTH_BODY_PREFIX = orjson.dumps(HEALTH_STATUS).decode()[:-1] + ',"timestamp":"'
+
+# Validate configuration at import time; gunicorn --preload runs this once in the
+# master, so missing configuration stops the service instead of crash-looping workers
+if not TENANT_ID or not CLIENT_ID:
+    logger.error("Missing required environment variables: AZURE_TENANT_ID and/or AZURE_CLIENT_ID")
+    sys.exit(1)
+
+logger.info("Starting JWT Backend Service")
+logger.info(f"Tenant ID: {TENANT_ID}")
+logger.info(f"Client ID: {CLIENT_ID}")
+logger.info(f"Audience: {AUDIENCE}")
+logger.info(f"Issuer V1: {ISSUER_V1}")
+logger.info(f"Issuer V2: {ISSUER_V2}")
+logger.info(f"JWKS URI: {JWKS_URI}")
+
+# How long (seconds) the fetched JWKS document is reused before re-fetching
+JWKS_LIFESPAN = 3600
+# The JWKS is refreshed in the background this many seconds (plus jitter) before it expires
+JWKS_REFRESH_MARGIN = 30
+# After a failed background refresh, retry after this many seconds (plus jitter)
+JWKS_RETRY_INTERVAL = 30
+# Validated tokens are remembered until they expire, capped at this many seconds
+TOKEN_CACHE_TTL = 300
+TOKEN_CACHE_MAXSIZE = 4096
+
+# Token hash -> (expiry timestamp, decoded claims, claim metadata), oldest entries first
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Created on first use in each worker (after gunicorn forks), together with its refresh thread
+_jwks_client = None
+_jwks_client_lock = threading.Lock()
+
+
+def get_jwks_client():
+    """Return the shared JWKS client, created lazily on first use in each worker"""
+    global _jwks_client
+    if _jwks_client is None:
+        with _jwks_client_lock:
+            if _jwks_client is None:
+                jwks_client = PyJWKClient(
+                    JWKS_URI,
+                    cache_keys=True,
+                    max_cached_keys=32,
+                    cache_jwk_set=True,
+                    lifespan=JWKS_LIFESPAN,
+                    timeout=10
+                )
+                threading.Thread(
+                    target=refresh_jwks_loop,
+                    args=(jwks_client,),
+                    name='jwks-refresh',
+                    daemon=True
+                ).start()
+                _jwks_client = jwks_client
+    return _jwks_client
+
+
+def refresh_jwks_loop(jwks_client):
+    """Keep the JWKS cache warm so requests never wait on a JWKS fetch"""
+    while True:
+        # The first request fetches the JWKS itself, so wait for it to near expiry.
+        # Jitter spreads refreshes out across workers and replicas.
+        time.sleep(JWKS_LIFESPAN - JWKS_REFRESH_MARGIN - random.uniform(0, JWKS_REFRESH_MARGIN))
+        while True:
+            try:
+                jwks_client.get_jwk_set(refresh=True)
+                logger.debug("JWKS refreshed")
+                break
+            except Exception as e:
+                # PyJWT drops its cached key set when a fetch fails; only signing keys
+                # already resolved by kid (the client's lru_cache) keep working
+                logger.warning("JWKS refresh failed, retrying shortly: %s", e)
+                time.sleep(JWKS_RETRY_INTERVAL + random.uniform(0, JWKS_RETRY_INTERVAL))
+
+
+def get_unverified_kid(token):
+    """Read the key ID from the JWT header without decoding the payload"""
+    header_b64 = token.split('.', 2)[0]
+    try:
+        header = orjson.loads(base64.urlsafe_b64decode(header_b64 + '=' * (-len(header_b64) % 4)))
+    except (binascii.Error, ValueError) as e:
+        raise jwt.DecodeError(f"Invalid header: {str(e)}") from e
+    if not isinstance(header, dict):
+        raise jwt.DecodeError("Invalid header: must be a JSON object")
+    kid = header.get('kid')
+    # A non-string kid would be unhashable for the client's lru_cache'd key lookup
+    if not isinstance(kid, str):
+        raise jwt.DecodeError("Invalid header: kid must be a string")
+    return kid
+
+
+def token_cache_key(token):
+    """Hash the raw token so the cache never holds bearer tokens in memory"""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+def format_timestamp(timestamp):
+    """Format a Unix timestamp as an ISO 8601 UTC string"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + 'Z'
+
+
+def utc_now_iso():
+    """Return the current UTC time as an ISO 8601 string with microseconds"""
+    now = time.time()
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + f'.{int(now % 1 * 1e6):06d}Z'
+
+
+def request_timestamp():
+    """Return the current request's timestamp, computed once and kept on flask.g"""
+    if 'timestamp' not in g:
+        g.timestamp = utc_now_iso()
+    return g.timestamp
+
+
+def build_token_meta(claims):
+    """Pre-format the claim timestamps that handlers and logs display"""
+    return {
+        'issued_at': format_timestamp(claims.get('iat', 0)),
+        'expires_at': format_timestamp(claims.get('exp', 0))
+    }
+
+
+def get_cached_claims(cache_key):
+    """Return (claims, meta) of a previously validated, unexpired token or None"""
+    with _token_cache_lock:
+        entry = _token_cache.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, claims, meta = entry
+        if expires_at <= time.time():
+            del _token_cache[cache_key]
+            return None
+        return claims, meta
+
+
+def cache_claims(cache_key, claims, meta):
+    """Remember validated claims until the token expires or the TTL elapses"""
+    expires_at = min(claims.get('exp', 0), time.time() + TOKEN_CACHE_TTL)
+    with _token_cache_lock:
+        _token_cache[cache_key] = (expires_at, claims, meta)
+        _token_cache.move_to_end(cache_key)
+        while len(_token_cache) > TOKEN_CACHE_MAXSIZE:
+            _token_cache.popitem(last=False)
 
 
 def validate_token(f):
@@ -43,82 +233,85 @@ def validate_token(f):
             logger.warning("No Authorization header found")
             return jsonify({'error': 'No authorization header'}), 401
         
+        if len(auth_header) > MAX_AUTH_HEADER_LENGTH:
+            logger.warning("Authorization header too large: %d characters", len(auth_header))
+            return jsonify({'error': 'Authorization header too large'}), 400
+        
         # Extract token
-        parts = auth_header.split()
-        if len(parts) != 2 or parts[0].lower() != 'bearer':
+        if len(auth_header) < 8 or auth_header[:7].lower() != 'bearer ':
             logger.warning("Invalid Authorization header format")
             return jsonify({'error': 'Invalid authorization header format'}), 401
         
-        token = parts[1]
+        token = auth_header[7:].strip()
         
         # Log the raw token (first 50 chars only for security)
-        logger.info(f"Received JWT token: {token[:50]}...")
-        logger.info(f"Full token length: {len(token)} characters")
+        logger.debug("Received JWT token: %s...", token[:50])
+        logger.debug("Full token length: %d characters", len(token))
+        
+        # Skip signature verification for a token that was already validated
+        cache_key = token_cache_key(token)
+        cached = get_cached_claims(cache_key)
+        if cached is not None:
+            logger.debug("Token found in validation cache")
+            request.decoded_token, request.decoded_token_meta = cached
+            return f(*args, **kwargs)
         
         try:
             # Get the signing key from Microsoft's JWKS endpoint
-            jwks_client = PyJWKClient(JWKS_URI)
-            signing_key = jwks_client.get_signing_key_from_jwt(token)
-            
-            # Decode token without verification first to check issuer
-            unverified = jwt.decode(token, options={"verify_signature": False})
-            issuer = unverified.get('iss', '')
-            
-            # Determine which issuer to use for validation
-            expected_issuer = ISSUER_V1 if issuer == ISSUER_V1 else ISSUER_V2
-            logger.info(f"Token issuer: {issuer}")
-            logger.info(f"Expected issuer: {expected_issuer}")
+            signing_key = get_jwks_client().get_signing_key(get_unverified_kid(token)).key
             
-            # Decode and validate the token
+            # Decode and validate the token (signature, exp, nbf, iat, aud and iss
+            # are all verified by default; either the v1.0 or v2.0 issuer is accepted)
             decoded_token = jwt.decode(
                 token,
-                signing_key.key,
-                algorithms=['RS256'],
+                signing_key,
+                algorithms=ALGORITHMS,
                 audience=AUDIENCE,
-                issuer=expected_issuer,
-                options={
-                    'verify_signature': True,
-                    'verify_exp': True,
-                    'verify_nbf': True,
-                    'verify_iat': True,
-                    'verify_aud': True,
-                    'verify_iss': True
-                }
+                issuer=ISSUERS
             )
             
-            # Log decoded token information
-            logger.info("=" * 80)
-            logger.info("JWT TOKEN VALIDATION SUCCESS")
-            logger.info("=" * 80)
-            logger.info(f"Token validated successfully at {datetime.utcnow().isoformat()}Z")
-            logger.info(f"\nToken Claims:")
-            logger.info(json.dumps(decoded_token, indent=2))
-            logger.info(f"\nIssuer: {decoded_token.get('iss')}")
-            logger.info(f"Subject: {decoded_token.get('sub')}")
-            logger.info(f"Audience: {decoded_token.get('aud')}")
-            logger.info(f"Issued At: {datetime.fromtimestamp(decoded_token.get('iat', 0)).isoformat()}Z")
-            logger.info(f"Expires At: {datetime.fromtimestamp(decoded_token.get('exp', 0)).isoformat()}Z")
-            logger.info(f"User Principal Name: {decoded_token.get('upn', 'N/A')}")
-            logger.info(f"Object ID: {decoded_token.get('oid', 'N/A')}")
-            logger.info("=" * 80)
+            logger.info("Token validated for sub=%s", decoded_token.get('sub'))
+            decoded_token_meta = build_token_meta(decoded_token)
+            
+            # Log decoded token information (only built when debug logging is on)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("=" * 80)
+                logger.debug("JWT TOKEN VALIDATION SUCCESS")
+                logger.debug("=" * 80)
+                logger.debug(f"Token validated successfully at {request_timestamp()}")
+                logger.debug(f"\nToken Claims:")
+                logger.debug(json.dumps(decoded_token, indent=2))
+                logger.debug(f"\nIssuer: {decoded_token.get('iss')}")
+                logger.debug(f"Subject: {decoded_token.get('sub')}")
+                logger.debug(f"Audience: {decoded_token.get('aud')}")
+                logger.debug(f"Issued At: {decoded_token_meta['issued_at']}")
+                logger.debug(f"Expires At: {decoded_token_meta['expires_at']}")
+                logger.debug(f"User Principal Name: {decoded_token.get('upn', 'N/A')}")
+                logger.debug(f"Object ID: {decoded_token.get('oid', 'N/A')}")
+                logger.debug("=" * 80)
             
             # Attach decoded token to request for use in handler
             request.decoded_token = decoded_token
+            request.decoded_token_meta = decoded_token_meta
+            cache_claims(cache_key, decoded_token, decoded_token_meta)
             
         except jwt.ExpiredSignatureError:
-            logger.error("Token has expired")
+            logger.warning("Token has expired")
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidAudienceError:
-            logger.error(f"Invalid audience. Expected: {CLIENT_ID}")
+            logger.warning("Invalid audience. Expected: %s", AUDIENCE)
             return jsonify({'error': 'Invalid token audience'}), 401
         except jwt.InvalidIssuerError:
-            logger.error(f"Invalid issuer. Expected: {ISSUER}")
-            return jsonify({'error': 'Invalid token issuer'}), 401
+            logger.warning("Invalid issuer. Expected one of: %s", ISSUERS)
+            return jsonify(INVALID_ISSUER_ERROR), 401
         except jwt.InvalidTokenError as e:
-            logger.error(f"Invalid token: {str(e)}")
+            logger.warning("Invalid token: %s", e)
             return jsonify({'error': f'Invalid token: {str(e)}'}), 401
+        except jwt.PyJWKClientError as e:
+            logger.warning("Signing key lookup failed: %s", e)
+            return jsonify({'error': f'Token validation failed: {str(e)}'}), 401
         except Exception as e:
-            logger.error(f"Token validation error: {str(e)}", exc_info=True)
+            logger.error("Token validation error: %s", e, exc_info=True)
             return jsonify({'error': f'Token validation failed: {str(e)}'}), 401
         
         return f(*args, **kwargs)
@@ -129,13 +322,7 @@ def validate_token(f):
 @app.route('/')
 def index():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'jwt-backend',
-        'timestamp': datetime.utcnow().isoformat() + 'Z',
-        'tenant_id': TENANT_ID,
-        'client_id': CLIENT_ID
-    })
+    return Response(HEALTH_BODY_PREFIX + request_timestamp() + '"}\n', mimetype='application/json')
 
 
 @app.route('/api/protected', methods=['GET', 'POST'])
@@ -143,24 +330,26 @@ def index():
 def protected():
     """Protected endpoint that requires valid JWT token"""
     decoded_token = request.decoded_token
+    decoded_token_meta = request.decoded_token_meta
+    upn = decoded_token.get('upn', 'N/A')
     
     response_data = {
         'message': 'Successfully accessed protected resource',
-        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'timestamp': request_timestamp(),
         'user': {
-            'upn': decoded_token.get('upn', 'N/A'),
+            'upn': upn,
             'name': decoded_token.get('name', 'N/A'),
             'oid': decoded_token.get('oid', 'N/A')
         },
         'token_info': {
             'issuer': decoded_token.get('iss'),
             'audience': decoded_token.get('aud'),
-            'issued_at': datetime.fromtimestamp(decoded_token.get('iat', 0)).isoformat() + 'Z',
-            'expires_at': datetime.fromtimestamp(decoded_token.get('exp', 0)).isoformat() + 'Z'
+            'issued_at': decoded_token_meta['issued_at'],
+            'expires_at': decoded_token_meta['expires_at']
         }
     }
     
-    logger.info(f"Protected endpoint accessed by user: {decoded_token.get('upn', 'N/A')}")
+    logger.info("Protected endpoint accessed by user: %s", upn)
     
     return jsonify(response_data)
 
@@ -171,27 +360,9 @@ def token_info():
     """Endpoint that returns full token information"""
     decoded_token = request.decoded_token
     
-    logger.info(f"Token info requested by user: {decoded_token.get('upn', 'N/A')}")
+    logger.info("Token info requested by user: %s", decoded_token.get('upn', 'N/A'))
     
     return jsonify({
         'message': 'Token decoded successfully',
         'claims': decoded_token
     })
-
-
-if __name__ == '__main__':
-    # Validate configuration
-    if not TENANT_ID or not CLIENT_ID:
-        logger.error("Missing required environment variables: AZURE_TENANT_ID and/or AZURE_CLIENT_ID")
-        sys.exit(1)
-    
-    logger.info("Starting JWT Backend Service")
-    logger.info(f"Tenant ID: {TENANT_ID}")
-    logger.info(f"Client ID: {CLIENT_ID}")
-    logger.info(f"Audience: {AUDIENCE}")
-    logger.info(f"Issuer V1: {ISSUER_V1}")
-    logger.info(f"Issuer V2: {ISSUER_V2}")
-    logger.info(f"JWKS URI: {JWKS_URI}")
-    
-    port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port, debug=False)
@@ -6,10 +6,15 @@ and sends requests to Application Gateway endpoint
 import os
 import sys
 import json
+import atexit
 import argparse
-from msal import PublicClientApplication
+from msal import PublicClientApplication, SerializableTokenCache
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timezone
+
+# MSAL token cache location, so refresh tokens survive between runs
+TOKEN_CACHE_PATH = os.path.expanduser('~/.cache/jwt-sender/cache.bin')
 
 
 class TokenSender:
@@ -19,11 +24,36 @@ class TokenSender:
         self.api_scope = api_scope
         self.authority = f"https://login.microsoftonline.com/{tenant_id}"
         
+        # Load the persisted token cache so silent refresh works across runs
+        self.token_cache = SerializableTokenCache()
+        if os.path.exists(TOKEN_CACHE_PATH):
+            with open(TOKEN_CACHE_PATH) as f:
+                self.token_cache.deserialize(f.read())
+        atexit.register(self.save_token_cache)
+        
         # Create MSAL Public Client Application
         self.app = PublicClientApplication(
             client_id=client_id,
-            authority=self.authority
+            authority=self.authority,
+            token_cache=self.token_cache
         )
+        
+        # Reuse one HTTP session so connections (and TLS handshakes) are pooled
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def save_token_cache(self):
+        """Persist the MSAL token cache (owner read/write only) if it changed"""
+        if not self.token_cache.has_state_changed:
+            return
+        os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), mode=0o700, exist_ok=True)
+        fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.token_cache.serialize())
+        os.chmod(TOKEN_CACHE_PATH, 0o600)
+        self.token_cache.has_state_changed = False
     
     def acquire_token_interactive(self):
         """Acquire token using interactive browser flow"""
@@ -88,9 +118,9 @@ class TokenSender:
         
         try:
             if method.upper() == 'GET':
-                response = requests.get(endpoint_url, headers=headers, timeout=30)
+                response = self.session.get(endpoint_url, headers=headers, timeout=30)
             elif method.upper() == 'POST':
-                response = requests.post(endpoint_url, headers=headers, timeout=30)
+                response = self.session.post(endpoint_url, headers=headers, timeout=30)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
@@ -176,7 +206,7 @@ Examples:
     print("=" * 80)
     print("JWT Token Sender Application")
     print("=" * 80)
-    print(f"Timestamp: {datetime.utcnow().isoformat()}Z")
+    print(f"Timestamp: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')}")
     
     try:
         # Create sender instance